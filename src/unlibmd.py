@@ -1,16 +1,70 @@
-import json
+import asyncio
+import collections
+import contextlib
+import queue
+import threading
+import httpx
 import requests
-import time
-import xml.etree.ElementTree as ET
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import importlib
-import xmltodict
+import functools
 from lxml import etree
+import pandas as pd
+
+# Use the faster orjson parser when installed, both provide `loads`
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
+# SHARED HTTP SESSION - POOLS CONNECTIONS ACROSS PAGES AND RETRIES THROTTLED REQUESTS
+# 429 responses are retried after the server's Retry-After delay, server errors with a backoff
+_RETRY = Retry(total=3,
+               backoff_factor=1,
+               status_forcelist=[429, 500, 502, 503, 504],
+               respect_retry_after_header=True,
+               raise_on_status=False)
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=_RETRY))
+_SESSION.headers.update({"Accept": "application/xml"})
+
+# TIMEOUTS OF THE ASYNC CLIENT - LARGE PAGES CAN TAKE MINUTES, BUT A STALLED STREAM MUST NOT
+# HANG THE WHOLE BATCH
+_ASYNC_TIMEOUT = httpx.Timeout(300.0, connect=30.0)
+
+# MARC XML NAMESPACE USED BY THE UNDL API FOR RECORDS
+_MARC_NS = "http://www.loc.gov/MARC21/slim"
+_MARC_RECORD = "{%s}record" % _MARC_NS
+
+# LXML PARSER OPTIONS FOR API RESPONSES
+# MARC records don't use XML ids, whitespace-only text nodes are dropped to keep the tree small
+# and entities are not resolved since responses come from the network
+_PARSER_OPTIONS = dict(huge_tree=True,
+                       collect_ids=False,
+                       remove_blank_text=True,
+                       resolve_entities=False)
+
+# SIZE OF THE CHUNKS FED TO THE PARSER WHILE A RESPONSE DOWNLOADS
+_CHUNK_SIZE = 64 * 1024
+
+# ADAPTIVE PAGE SIZE ('rg' PARAMETER)
+# Pages start at the largest size, which needs the fewest requests. The size is halved after a
+# slow page and doubled back, up to the starting size, once a whole window of pages was fast.
+_PAGE_SIZE = 200
+_MIN_PAGE_SIZE = 10
+_SLOW_PAGE = 30.0  # seconds
+_LATENCY_WINDOW = 5
 
 # GET UNDL API KEY
+@functools.lru_cache(maxsize=1)
 def get_key(path="../exclude/keys.json"):
     """
     Retrieves the 'undl_api_key' from a JSON file.
 
+    The key is read once and cached for the process, so paged requests don't reopen the file.
+    Call `get_key.cache_clear()` after changing the file.
+
     Args:
         path (str): The path to the JSON file containing the credentials.
                     Defaults to '../exclude/keys.json' if not provided.
@@ -24,9 +78,9 @@ def get_key(path="../exclude/keys.json"):
     """
     try:
         # Open the JSON file at the specified path
-        with open(path) as f:
+        with open(path, 'rb') as f:
             # Load the JSON data into a dictionary
-            credentials = json.load(f)
+            credentials = _json.loads(f.read())
             # Retrieve and return the 'undl_api_key' from the dictionary
             return credentials['undl_api_key']
     except FileNotFoundError:
@@ -45,123 +99,346 @@ def get_records_xml(parameters, api_key=None, check=1000):
         check (int, optional): Number of records to fetch before printing status. Defaults to 1000.
 
     Returns:
-        xml.etree.ElementTree.ElementTree: The XML tree containing all the records.
+        lxml.etree._ElementTree: The XML tree containing all the records.
+
+    Raises:
+        requests.HTTPError: If the API is still throttling (429) or failing (5xx) after the
+                            session's retries.
+    """
+    # Append each record directly to the root element as it is parsed
+    root = etree.Element("collection")
+    root.extend(iter_records_xml(parameters, api_key=api_key, check=check))
+
+    # Return the XML tree containing all the records
+    return etree.ElementTree(root)
+
+
+# ITERATE OVER XML RECORDS FROM UNDL AS THEY ARRIVE
+def iter_records_xml(parameters, api_key=None, check=1000):
+    """
+    Fetches all records from the UN Digital Library API, yielding each record as soon as it
+    has been parsed.
+
+    The first page is parsed while it downloads, which also gives the search_id. The following
+    pages are then downloaded by a background thread while the current page is parsed.
+
+    Args:
+        params (dict): The parameters to be sent with the API request.
+        api_key (str): The API key for authentication.
+        check (int, optional): Number of records to fetch before printing status. Defaults to 1000.
+
+    Yields:
+        lxml.etree._Element: The 'record' elements, detached from the response.
+
+    Raises:
+        requests.HTTPError: If the API is still throttling (429) or failing (5xx) after the
+                            session's retries.
     """
 
     # Initialize variables
     url = "https://digitallibrary.un.org/api/v1/search?"
     search_id = None
     total = None
-    root = ET.Element("collection")
-    all_records = []
+    total_seen = 0
+    pages = None
+    stop = threading.Event()
     if api_key is None:
         api_key = get_key()
+    params = parameters.copy()
+    params.setdefault("rg", _PAGE_SIZE)
+    max_size = params["rg"]
+    first_size = int(max_size)
+    # Largest page the server actually returns, learnt from the first page
+    page_cap = first_size
+    latencies = collections.deque(maxlen=_LATENCY_WINDOW)
+    headers = {
+        "content-type": "application/xml",
+        "Authorization": "Token {}".format(api_key)
+    }
+
+    def fetch():
+        return _timed_get(url, params, headers, latencies, max_size)
+
+    def page_size():
+        return min(int(params["rg"]), page_cap)
 
     # Fetch records in a loop until there are no more records
-    while True:
-        if search_id:
-            # If search_id exists, add it to the request parameters
-            params['search_id'] = search_id
-        else:
-            # If search_id doesn't exist, create a copy of the original params
-            params = parameters.copy()
-
-        # Make the HTTP GET request to fetch the MARC XML data
-        r = requests.get(url,
-                         params=params,
-                         headers={
-                             "content-type": "application/xml",
-                             "Authorization": "Token {}".format(api_key)
-                         })
-        
-        # Check if the request was successful
-        if r.status_code != 200:
-            if r.status_code == 429:
-                print("Let's wait 5 minutes! Too many requests, they say!")
-                time.sleep(300)  # Wait for 5 minutes
-                print("Let's try again!")
-                r = requests.get(url,
-                         params=params,
-                         headers={
-                             "content-type": "application/xml",
-                             "Authorization": "Token {}".format(api_key)
-                         })
+    try:
+        while True:
+            if pages is None:
+                # Make the HTTP GET request to fetch the first page, streaming the body
+                # Throttled (429) requests are retried by the session, honouring Retry-After
+                r = _timed_get(url, params, headers, latencies, max_size, stream=True)
+                chunks = r.iter_content(_CHUNK_SIZE)
             else:
+                # Take the next page already downloaded by the background thread
+                r = pages.get()
+                if r is None:
+                    # The background thread requested every page it expected to need. If pages
+                    # were shorter than expected, request the remaining records with a new one.
+                    pages = _prefetch_pages(fetch, stop, int(total) - total_seen, page_size)
+                    continue
+                if isinstance(r, Exception):
+                    raise r
+                chunks = (r.content,)
+
+            # Check if the request was successful
+            # Raise rather than return partial results once the session's retries are used up
+            if r.status_code in _RETRY.status_forcelist:
+                raise requests.HTTPError(
+                    f"Received status code {r.status_code} after {_RETRY.total} retries "
+                    f"({total_seen} of {total} records fetched)", response=r)
+            if r.status_code != 200:
                 print(f"Error: Received status code {r.status_code}")
                 break
 
-        # Parse the response XML and remove the namespace
-        try:
-            response = ET.fromstring(
-                r.text.replace('xmlns="http://www.loc.gov/MARC21/slim"', ''))
-        except ET.ParseError as e:
-            print("ParseError:", e)
-            print("Response text:", r.text)
-            break
+            # Parse the response XML as it arrives, collecting search_id, total and records
+            page_seen = 0
+            try:
+                for tag, value in _iter_page(chunks):
+                    if tag == "search_id":
+                        # Get the search_id from the response
+                        search_id = value
+                    elif tag == "total":
+                        # Get and print total number of records if total = None
+                        if not total:
+                            total = value
+                            print("Total nb. of records: " + total)
+                    else:
+                        page_seen += 1
+                        yield value
+            except etree.XMLSyntaxError as e:
+                print("ParseError:", e)
+                break
 
-        # Get the search_id from the response
-        search_id = response.find('search_id').text
-        
-        # Get and print total number of records if total = None
-        if not total:
-            total = response.find('total').text
-            print("Total nb. of records: " + total)
+            # If there are no records in the collection, exit the loop
+            if not page_seen:
+                break
 
-        # Find the collection element in the response
-        collection = response.find('collection')
+            # Print the number of records fetched each time another `check` records are reached
+            previous_seen = total_seen
+            total_seen += page_seen
+            if total_seen // check > previous_seen // check:
+                print("Nb. of records processed: " + str(total_seen))
 
-        # If there are no records in the collection, exit the loop
-        if not collection:
-            break
+            # Stop once every record announced by the API has been received
+            if total and total_seen >= int(total):
+                break
 
-        # Append each record to the list of all records
-        for record in collection.findall("record"):
-            all_records.append(record)
-        
-        # Print the number of records fetched
-        if len(all_records) % check == 0:
-            print("Nb. of records processed: " + str(len(all_records)))
+            # Once the search_id is known, download the following pages in the background,
+            # requesting no more pages than needed for the records left
+            if pages is None:
+                params['search_id'] = search_id
+                if page_seen < first_size:
+                    page_cap = page_seen
+                remaining = int(total) - total_seen if total else None
+                pages = _prefetch_pages(fetch, stop, remaining, page_size)
+    finally:
+        # Stop the background thread, whichever way the loop was left
+        stop.set()
+
+
+## TIME REQUESTS AND ADAPT THE PAGE SIZE
+def _timed_get(url, params, headers, latencies, max_size, **kwargs):
+    """
+    Sends a GET request with the shared session and adapts params['rg'] to its latency.
 
-    # Append all the records to the root element
-    for record in all_records:
-        root.append(record)
-    # Create a new XML tree with the root element
-    new_xml_tree = ET.ElementTree(root)
+    Args:
+        url (str): The URL of the request.
+        params (dict): The parameters of the request, 'rg' is updated for the next request.
+        headers (dict): The headers of the request.
+        latencies (collections.deque): The latencies of the latest requests.
+        max_size (int): The largest page size to use.
+        **kwargs: Passed on to `requests.Session.get`.
 
-    # Return the XML tree containing all the records
-    return new_xml_tree
+    Returns:
+        requests.Response: The response.
+    """
+    r = _SESSION.get(url, params=params, headers=headers, **kwargs)
+    _update_page_size(params, latencies, _response_latency(r), max_size)
+    return r
 
-# CONVERT XML_TREE RETURNED BY `get_records_xml` INTO A LIST OF RECORDS
 
-def convert_lxml(xml_et):
+def _response_latency(r):
     """
-    Converts an lxml ElementTree to a list of 'record' elements.
+    Returns the time the server took to send the headers of a response, in seconds.
+
+    This is measured the same way whether the body is streamed or not. Returns None if the
+    session retried the request, since its Retry-After and backoff waits would be counted too.
 
     Args:
-        xml_et (etree._ElementTree): The input XML ElementTree.
+        r (requests.Response): The response.
 
     Returns:
-        list: A list of 'record' elements found in the XML.
+        float or None: The latency, or None if the request was retried.
     """
-    xml_string = ET.tostring(xml_et.getroot(), encoding='utf-8')
-    xml_root = etree.fromstring(xml_string)
-    xml_tree = etree.ElementTree(xml_root)
-    records = xml_tree.findall('record')
-    return records
+    retries = getattr(r.raw, "retries", None)
+    if retries is not None and retries.history:
+        return None
+    return r.elapsed.total_seconds()
 
 
+def _update_page_size(params, latencies, latency, max_size):
+    """
+    Records the latency of a request and sets params['rg'] for the next one: halved if the
+    request was slow, doubled up to `max_size` if the latest requests were all fast.
+
+    Args:
+        params (dict): The request parameters, holding the current page size under 'rg'.
+        latencies (collections.deque): The latencies of the latest requests, with a maxlen.
+        latency (float or None): The latency of the request, in seconds, None to leave the
+                                 page size unchanged.
+        max_size (int): The largest page size to use.
+    """
+    if latency is None:
+        return
+    latencies.append(latency)
+    size = int(params["rg"])
+    if latency > _SLOW_PAGE:
+        size = max(size // 2, _MIN_PAGE_SIZE)
+    elif len(latencies) == latencies.maxlen and max(latencies) < _SLOW_PAGE / 2:
+        size = min(size * 2, int(max_size))
+    params["rg"] = size
+
+
+## PARSE ONE PAGE OF THE API RESPONSE
+def _iter_page(chunks):
+    """
+    Parses an API response page incrementally with `etree.XMLPullParser`, as its chunks arrive.
+
+    Records are stripped of the MARC namespace and detached from the response tree as soon
+    as they are complete, so the response tree does not grow while parsing.
+
+    Args:
+        chunks (iterable): The response body, as bytes chunks.
+
+    Yields:
+        tuple: (tag, value), with the text of the "search_id" and "total" elements, and the
+               element itself for each "record".
+
+    Raises:
+        etree.XMLSyntaxError: If the response is not well-formed XML.
+    """
+    parser = etree.XMLPullParser(events=("end",),
+                                 tag=("search_id", "total", _MARC_RECORD),
+                                 **_PARSER_OPTIONS)
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from _read_page_events(parser)
+    parser.close()
+    yield from _read_page_events(parser)
+
+
+def _read_page_events(parser):
+    """
+    Yields the (tag, value) pairs for the elements completed so far by `parser`, see `_iter_page`.
+    """
+    for _, elem in parser.read_events():
+        if elem.tag == "search_id" or elem.tag == "total":
+            yield elem.tag, elem.text
+        else:
+            # Remove the MARC namespace from the record and its descendants
+            for el in elem.iter(tag=etree.Element):
+                el.tag = etree.QName(el).localname
+            elem.getparent().remove(elem)
+            etree.cleanup_namespaces(elem)
+            yield "record", elem
+
+
+def _parse_page(content):
+    """
+    Parses a complete API response page with `_iter_page`.
+
+    Args:
+        content (bytes): The response body.
+
+    Returns:
+        tuple: (search_id, total, records), search_id and total are None if not in the response.
+
+    Raises:
+        etree.XMLSyntaxError: If the response is not well-formed XML.
+    """
+    page = {"search_id": None, "total": None}
+    records = []
+    for tag, value in _iter_page((content,)):
+        if tag == "record":
+            records.append(value)
+        else:
+            page[tag] = value
+    return page["search_id"], page["total"], records
+
+
+## DOWNLOAD PAGES IN A BACKGROUND THREAD
+def _prefetch_pages(fetch, stop, remaining=None, page_size=None, maxsize=2):
+    """
+    Calls `fetch` repeatedly in a background thread and queues the responses, so the next
+    page downloads while the current one is being parsed.
+
+    The search_id cursor only allows pages to be requested one after the other, so a single
+    thread is used. It stops once `stop` is set, after a non-200 response or an exception,
+    which is queued for the caller to raise. When `remaining` is given, it also stops once the
+    pages requested are expected to hold that many records, and then queues None.
+
+    Args:
+        fetch (callable): Function returning the next `requests.Response`.
+        stop (threading.Event): Event set by the caller when no more pages are needed.
+        remaining (int, optional): Number of records still to fetch, None if unknown.
+        page_size (callable, optional): Function returning the number of records expected in
+                                        the next page. Required with `remaining`.
+        maxsize (int, optional): Maximum number of pages waiting in the queue. Defaults to 2.
+
+    Returns:
+        queue.Queue: The queue the responses are put in, in request order.
+    """
+    pages = queue.Queue(maxsize=maxsize)
+
+    def put(item):
+        # Wait for room in the queue, unless the caller is done
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def worker():
+        requested = 0
+        while not stop.is_set():
+            if remaining is not None and requested >= remaining:
+                # Every page expected to be needed has been requested
+                put(None)
+                return
+            try:
+                if remaining is not None:
+                    requested += page_size()
+                r = fetch()
+            except Exception as e:
+                # Queue the error for the caller, who would otherwise wait for a page forever
+                r = e
+            put(r)
+            if isinstance(r, Exception) or r.status_code != 200:
+                return
+
+    threading.Thread(target=worker, daemon=True).start()
+    return pages
+
 # EXTRACT AND CONVERT SELECTED MARC XML ELEMENTS INTO A DICTIONARY
 def extract_xml(record, elements):
     """
     Extracts data from an XML record and organizes it into a dictionary.
 
+    The record's fields are walked once, whatever the number of elements requested.
+
     Parameters:
         record (Element): An XML element representing the record to extract data from.
         elements (list): A list of dictionaries where each dictionary contains:
                         - field: Marc field number.
                         - element: Type of metadata element to extract: field, subfield.
                         - code: Subfield code of the metadata element to extract (e.g., 'a', 'b', 'c').
+                        - ind1: First indicator the field must have, or None.
                         - name: Key name to use for the metadata element in the returned dictionary.
+                        When extracting many records, pass `compile_elements(elements)` instead,
+                        so the definitions are not prepared again for every record.
 
     Returns:
         dict: A dictionary with keys as specified in `elements` and values extracted
@@ -170,55 +447,167 @@ def extract_xml(record, elements):
     # Initialize the dictionary to store extracted data.
     dictionary_record = {}
 
-    # Transform each element in the `elements` list into a query structure using `get_query`.
-    # This prepares the XPath or other querying mechanism for extracting the data.
-    elements = [get_query(e) for e in elements]
-
-    # Extract the unique identifier (e.g., "001" field) from the control field.
-    # Store it in the dictionary under the key "undl_id".
-    control_field = record.find("controlfield[@tag='001']")
-    dictionary_record["undl_id"] = control_field.text if control_field is not None else None
-
-    # Iterate through each metadata element definition in `elements`.
-    for element in elements:
-        # Use the query to locate matching XML elements in the record.
-        xml_element = record.findall(element["query"])
-
-        # Case 1: Exactly one matching element is found.
-        if len(xml_element) == 1:
-            if element["element"] == "field":
-                # For "field" elements, extract subfield code-value pairs.
-                v = [{e.get("code"): e.text for e in xml_element[0].xpath(".//subfield")}]
-            else:
-                # Otherwise, use the text content of the single matching element.
-                v = [xml_element[0].text]
-
-        # Case 2: Multiple matching elements are found.
-        elif len(xml_element) > 1:
-            if element["element"] == "field":
-                # For "field" elements, extract subfield code-value pairs for all matches.
-                code_value_list = []
-                for datafield in xml_element:
-                    code_value_list.extend(
-                        [{e.get("code"): e.text for e in datafield.xpath(".//subfield")}]
-                    )
-                v = code_value_list
-            else:
-                # For other elements, collect text content from all matches.
-                v = [e.text for e in xml_element]
+    # Group the element definitions by datafield tag, so each datafield is matched in one lookup.
+    field_map, names = compile_elements(elements)
 
-        # Case 3: No matching elements are found.
-        else:
-            # If no matches are found, set the value to None.
-            v = None
+    # Walk the record once, collecting the values of every element definition.
+    undl_id, found = _extract_values(record, field_map, len(names))
 
-        # Store the extracted value in the dictionary using the specified key name.
-        dictionary_record[element["name"]] = v
+    # Store the identifier under the key "undl_id", then the extracted values in the order of
+    # `elements`, using the specified key names. Elements without any match are set to None.
+    dictionary_record["undl_id"] = undl_id
+    for name, v in zip(names, found):
+        dictionary_record[name] = v
 
     # Return the dictionary containing all extracted data.
     return dictionary_record
 
 
+# EXTRACT SELECTED MARC XML ELEMENTS INTO COLUMNS
+def extract_xml_into(record, elements, columns):
+    """
+    Extracts data from an XML record like `extract_xml`, appending the values to columns
+    instead of returning a dictionary per record.
+
+    Parameters:
+        record (Element): An XML element representing the record to extract data from.
+        elements (list): A list of element definitions or their `compile_elements` result,
+                         see `extract_xml`.
+        columns (dict): Key name -> list of values, with a list for "undl_id" and for each
+                        name in `elements`.
+    """
+    field_map, names = compile_elements(elements)
+    _append_values(record, field_map, names, columns)
+
+
+# CONVERT A LIST OF RECORDS INTO A DATAFRAME
+def extract_xml_dataframe(records, elements):
+    """
+    Extracts data from a list of XML records into a DataFrame, one row per record.
+
+    Gives the same table as `pd.DataFrame([extract_xml(r, elements) for r in records])`, but
+    the values are appended to one list per column instead of a dictionary per record.
+
+    Parameters:
+        records (list): The XML 'record' elements to extract data from.
+        elements (list): A list of element definitions, see `extract_xml`. Names must be unique.
+
+    Returns:
+        pd.DataFrame: A DataFrame with an "undl_id" column and a column per name in `elements`.
+    """
+    # The element definitions are grouped once for all the records
+    field_map, names = compile_elements(elements)
+    columns = {name: [] for name in ["undl_id"] + names}
+    for record in records:
+        _append_values(record, field_map, names, columns)
+    return pd.DataFrame(columns)
+
+
+def _append_values(record, field_map, names, columns):
+    """
+    Walks a record with `_extract_values` and appends its values to `columns`.
+    """
+    undl_id, found = _extract_values(record, field_map, len(names))
+    columns["undl_id"].append(undl_id)
+    for name, v in zip(names, found):
+        columns[name].append(v)
+
+
+## WALK A RECORD ONCE AND COLLECT THE VALUES OF EACH ELEMENT DEFINITION
+def _extract_values(record, field_map, count):
+    """
+    Walks the control fields and datafields of a record once, collecting the matching values.
+
+    Parameters:
+    record (Element): An XML element representing the record to extract data from.
+    field_map (dict): The element definitions grouped by datafield tag, from `compile_elements`.
+    count (int): The number of element definitions.
+
+    Returns:
+    tuple: (undl_id, found), found holding for each definition a list of values, or None if
+           nothing matched.
+    """
+    # Values found for each element definition, None until a match is found.
+    found = [None] * count
+    undl_id = None
+
+    # Bind the lookups used for every datafield to local names.
+    specs_for = field_map.get
+    no_specs = ()
+
+    # Walk the control fields and datafields of the record once.
+    for child in record.iterchildren("controlfield", "datafield"):
+        get = child.get
+        tag = get("tag")
+
+        # Extract the unique identifier from the "001" control field.
+        if child.tag == "controlfield":
+            if tag == "001" and undl_id is None:
+                undl_id = child.text
+            continue
+
+        # Match the datafield against the element definitions for its tag.
+        for index, ind1, code, is_field in specs_for(tag, no_specs):
+            if ind1 and get("ind1") != ind1:
+                continue
+
+            # Without a code the datafield itself is matched, otherwise its subfields with that code.
+            # Subfields are always direct children of the datafield, walk them directly.
+            if code is None:
+                matches = (child,)
+            else:
+                matches = [sf for sf in child.iterchildren("subfield") if sf.get("code") == code]
+
+            values = found[index]
+            if values is None and matches:
+                values = found[index] = []
+            for match in matches:
+                if is_field:
+                    # For "field" elements, extract subfield code-value pairs.
+                    values.append({sf.get("code"): sf.text for sf in match.iterchildren("subfield")})
+                else:
+                    # Otherwise, use the text content of the matching element.
+                    values.append(match.text)
+
+    return undl_id, found
+
+
+# ELEMENT DEFINITIONS PREPARED BY `compile_elements`
+ElementPlan = collections.namedtuple("ElementPlan", ["field_map", "names"])
+
+
+## GROUP ELEMENT DEFINITIONS BY DATAFIELD TAG
+def compile_elements(elements):
+    """
+    Groups the element definitions passed to `extract_xml` by datafield tag.
+
+    The result can be passed to `extract_xml` and `extract_xml_into` in place of `elements`,
+    and is returned unchanged if passed again.
+
+    Parameters:
+    elements (list): The element definitions, see `extract_xml`.
+
+    Returns:
+    ElementPlan: A (field_map, names) named tuple
+        field_map (dict): Datafield tag -> list of (index, ind1, code, is_field) tuples, index being
+                          the position of the definition in `elements` and is_field True for
+                          "field" elements.
+        names (list): The key names of the definitions, in the order of `elements`.
+    """
+    if isinstance(elements, ElementPlan):
+        return elements
+    field_map = {}
+    names = []
+    for index, element in enumerate(elements):
+        # Compare as strings, datafield attributes are read as strings from the XML
+        ind1, code = element["ind1"], element["code"]
+        field_map.setdefault(str(element["field"]), []).append(
+            (index, str(ind1) if ind1 else ind1, None if code is None else str(code),
+             element["element"] == "field"))
+        names.append(element["name"])
+    return ElementPlan(field_map, names)
+
+
 ## CONSTRUCT XPATH TO RETRIEVE MARC XML ELEMENTS
 def get_query(element):
     """
@@ -250,8 +639,7 @@ def get_query(element):
         query += f"[@ind1='{ind1}']"
     
     # If 'code' is provided (including an empty string), append the subfield code to the query string
-    # The condition allows 'code' to be an empty string but excludes None
-    if code or code == "":
+    if code is not None:
         query += f"/subfield[@code='{code}']"
     
     # Add the constructed query string to the dictionary under the key 'query'
@@ -271,7 +659,27 @@ def undl_request(parameters, result_queue=None):
     result_queue (queue.Queue): A queue to store the result of the function.
 
     Returns:
-    tuple: (log, records), records will be empty if no records are retrieved.
+    tuple: (log, records), records is a list of lxml 'record' elements, empty if no records are retrieved.
+    """
+    log, records, _ = _undl_request(parameters)
+    
+    # Return a tuple containing the log and records
+    result = (log, records)
+    
+    # If a result queue is provided, put the result in the queue
+    if result_queue is not None:
+        result_queue.put(result)
+    
+    return result
+
+
+def _undl_request(parameters):
+    """
+    Makes the request of `undl_request`, also returning its latency for the adaptive page size.
+
+    Returns:
+    tuple: (log, records, latency), latency as returned by `_response_latency`, None if the
+           request failed.
     """
     
     # Initialize all variables
@@ -281,6 +689,7 @@ def undl_request(parameters, result_queue=None):
     total = None
     search_id = None
     error = None
+    latency = None
     
     # Add format as 'xml' to the request parameters
     parameters["format"] = "xml"
@@ -293,51 +702,14 @@ def undl_request(parameters, result_queue=None):
     
     # Make the API request with the provided parameters and authorization header
     try:
-        retry_count = 0
+        # Send the GET request to the API
+        # Throttled (429) requests are retried by the session, honouring Retry-After
+        r = _SESSION.get(url, params=parameters, headers={"Authorization": "Token " + key}, stream=True)
+        status = r.status_code
+        latency = _response_latency(r)
         
-        # Retry up to 2 times if the request fails
-        while retry_count < 2:
-            # Send the GET request to the API
-            r = requests.get(url, params=parameters, headers={"Authorization": "Token " + key}, stream=True)
-            status = r.status_code
-            
-            # Check if the status code is 429 (Too Many Requests)
-            if status == 429:
-                # Handle too many requests error by waiting and retrying
-                error = "Let's wait 5 minutes! Too many requests, they say!"
-                print(error)
-                retry_count += 1
-                time.sleep(300)  # Wait for 5 minutes before retrying
-                print("Let's try again...")
-                continue  # Skip the rest of the loop and retry
-            
-            # Check if the status code is not 200 (OK)
-            elif status != 200:
-                # Parse the error message from the response
-                try:
-                    r_dict = r.json()
-                except ValueError:
-                    error = f"{status}: Unable to parse error message"
-                break  # Exit the retry loop
-            
-            # If the request was successful
-            elif status == 200:
-                # Parse the XML response
-                r_dict = xmltodict.parse(r.text, encoding='UTF-8')
-                
-                # Extract the total number of results and search ID from the response
-                total = int(r_dict['response']['total'])
-                try:
-                    search_id = r_dict['response']['search_id']
-                except KeyError:
-                    print("No records, check your search parameters!")
-                
-                # Check if records are present in the response
-                if 'record' in r_dict['response']['collection']:
-                    records = r_dict['response']['collection']['record']
-                else:
-                    error = f"{status}: No records"
-                break  # Exit the retry loop
+        # Read the total, search ID, records and error from the response
+        total, search_id, records, error = _read_response(status, r.content)
     
     except requests.exceptions.RequestException as e:
         # Handle any exceptions raised during the request
@@ -346,14 +718,58 @@ def undl_request(parameters, result_queue=None):
     # Log the request details
     log = [status, total, len(records), error, search_id]
     
-    # Return a tuple containing the log and records
-    result = (log, records)
-    
-    # If a result queue is provided, put the result in the queue
-    if result_queue is not None:
-        result_queue.put(result)
-    
-    return result
+    return log, records, latency
+
+
+## READ AN API RESPONSE RETURNED TO `undl_request`
+def _read_response(status, content):
+    """
+    Reads the total, search ID and records from the body of an API response.
+
+    Parameters:
+    status (int): The HTTP status code of the response.
+    content (bytes): The body of the response.
+
+    Returns:
+    tuple: (total, search_id, records, error), records is a list of lxml 'record' elements
+           and error is None unless the request failed or returned no records.
+    """
+    total = None
+    search_id = None
+    records = []
+    error = None
+
+    # Check if the status code is still 429 (Too Many Requests) after retrying
+    if status == 429:
+        error = f"{status}: Too many requests, they say!"
+        print(error)
+
+    # Check if the status code is not 200 (OK)
+    elif status != 200:
+        # Parse the error message from the response
+        try:
+            _json.loads(content)
+        except ValueError:
+            error = f"{status}: Unable to parse error message"
+
+    # If the request was successful
+    else:
+        # Parse the XML response bytes directly with lxml, records come back as lxml elements
+        try:
+            search_id, page_total, records = _parse_page(content)
+        except etree.XMLSyntaxError as e:
+            error = f"{status}: Unable to parse response ({e})"
+        else:
+            # Extract the total number of results from the response
+            total = int(page_total) if page_total is not None else None
+            if search_id is None:
+                print("No records, check your search parameters!")
+
+            # Check if records are present in the response
+            if not records:
+                error = f"{status}: No records"
+
+    return total, search_id, records, error
 
 
 def get_records_json(parameters, check=1000):
@@ -366,11 +782,16 @@ def get_records_json(parameters, check=1000):
     Returns:
     tuple: (logs, all_records)
         logs (list): A list of logs for each request made.
-        all_records (list): A list of all records retrieved.
+        all_records (list): A list of all records retrieved, as lxml 'record' elements.
     """
     
     # Make a local copy of the parameters to avoid modifying the original
     search_parameters = parameters.copy()
+
+    # Start with the largest page size, adapted to the latency of the requests
+    search_parameters.setdefault("rg", _PAGE_SIZE)
+    max_size = search_parameters["rg"]
+    latencies = collections.deque(maxlen=_LATENCY_WINDOW)
     
     # Initialize variables to store all records, total number of records, and logs
     all_records = []
@@ -380,30 +801,158 @@ def get_records_json(parameters, check=1000):
     # Loop until all records are retrieved
     while len(all_records) != total:
         # Make the API request and retrieve the log and records
-        log, records = undl_request(search_parameters)
+        log, records, latency = _undl_request(search_parameters)
+        _update_page_size(search_parameters, latencies, latency, max_size)
         
         # Extend the list of all records with the new records retrieved
+        previous_count = len(all_records)
         all_records.extend(records)
         
         # Append the log of this request to the logs list
         logs.append(log)
+
+        # Stop on a failed or empty page rather than requesting it again
+        # Throttled (429) requests have already been retried by the session
+        if not records:
+            break
         
         # If total is not set, retrieve and print the total number of records
-        if total is None:
+        if total is None and log[1] is not None:
             total = log[1]
             print("Total number of records: " + str(total))
             
             # Update the search parameters to include the search_id for subsequent requests
             search_parameters["search_id"] = log[-1]
         
-        # Print the number of records processed every 1000 records
-        if len(all_records) % check == 0:
+        # Print the number of records processed each time another `check` records are reached
+        if len(all_records) // check > previous_count // check:
             print("Number of records processed: " + str(len(all_records)))
     
     # Return the logs and all records retrieved
     return logs, all_records
 
 
+# --- ASYNC FUNCTIONS TO RETRIEVE THE RECORDS OF MANY SEARCHES CONCURRENTLY
+async def undl_request_async(client, parameters, semaphore=None):
+    """
+    Async version of `undl_request`, sending the request with a shared `httpx.AsyncClient`.
+
+    Throttled (429) and failed (5xx) requests are retried like in the shared session: up to 3
+    times, waiting for the Retry-After delay or, without one, with an exponential backoff.
+
+    Parameters:
+    client (httpx.AsyncClient): The client used to send the request.
+    parameters (dict): A dictionary of parameters to be sent in the API request.
+    semaphore (asyncio.Semaphore, optional): Limits the number of requests in flight.
+
+    Returns:
+    tuple: (log, records), as returned by `undl_request`.
+    """
+    records = []
+    status = None
+    total = None
+    search_id = None
+    error = None
+
+    parameters["format"] = "xml"
+    url = "https://digitallibrary.un.org/api/v1/search"
+    key = get_key()
+
+    try:
+        for attempt in range(_RETRY.total + 1):
+            # Only hold the semaphore while the request is in flight, not while waiting to retry
+            async with semaphore or contextlib.nullcontext():
+                r = await client.get(url, params=parameters, headers={"Authorization": "Token " + key})
+            if r.status_code not in _RETRY.status_forcelist or attempt == _RETRY.total:
+                break
+            backoff = _RETRY.backoff_factor * 2 ** attempt
+            try:
+                delay = float(r.headers.get("Retry-After", backoff))
+            except ValueError:
+                delay = backoff
+            await asyncio.sleep(delay)
+        status = r.status_code
+
+        # Read the total, search ID, records and error from the response
+        total, search_id, records, error = _read_response(status, r.content)
+
+    except httpx.HTTPError as e:
+        # Handle any exceptions raised during the request
+        error = str(e)
+
+    log = [status, total, len(records), error, search_id]
+    return log, records
+
+
+async def _get_records_json_async(client, parameters, semaphore):
+    """
+    Async version of `get_records_json` for one search, without the progress printing.
+
+    The pages of a search are fetched one after the other since they follow its search_id.
+
+    Returns:
+    tuple: (logs, all_records), as returned by `get_records_json`.
+    """
+    search_parameters = parameters.copy()
+    search_parameters.setdefault("rg", _PAGE_SIZE)
+    all_records = []
+    total = None
+    logs = []
+
+    while len(all_records) != total:
+        log, records = await undl_request_async(client, search_parameters, semaphore)
+        all_records.extend(records)
+        logs.append(log)
+
+        # Stop on a failed or empty page rather than requesting it again
+        if not records:
+            break
+
+        if total is None:
+            total = log[1]
+            search_parameters["search_id"] = log[-1]
+
+    return logs, all_records
+
+
+async def get_records_json_many(param_list, concurrency=16):
+    """
+    Fetches all records of several searches concurrently over one HTTP/2 connection pool.
+
+    In a notebook, call it with `await md.get_records_json_many(param_list)`.
+
+    Parameters:
+    param_list (list): A list of parameters dictionaries, one per search.
+    concurrency (int, optional): Maximum number of requests in flight. Defaults to 16.
+
+    Returns:
+    list: One (logs, all_records) tuple per search, in the order of `param_list`.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(http2=True,
+                                 limits=httpx.Limits(max_connections=32),
+                                 headers={"Accept": "application/xml"},
+                                 timeout=_ASYNC_TIMEOUT) as client:
+        return await asyncio.gather(
+            *(_get_records_json_async(client, parameters, semaphore) for parameters in param_list))
+
+
+def get_records_json_batch(param_list, concurrency=16):
+    """
+    Synchronous wrapper around `get_records_json_many`, for scripts.
+
+    Jupyter already runs an event loop, await `get_records_json_many` directly there instead.
+
+    Parameters:
+    param_list (list): A list of parameters dictionaries, one per search.
+    concurrency (int, optional): Maximum number of requests in flight. Defaults to 16.
+
+    Returns:
+    list: One (logs, all_records) tuple per search, in the order of `param_list`.
+    """
+    return asyncio.run(get_records_json_many(param_list, concurrency=concurrency))
+
+
 ### --- UTILITIES ---
 
 ## ADD LINKS USING AN ID AND A TEMPLATE
@@ -444,11 +993,10 @@ def convert_me_id(column_value):
                                the original input is returned.
     """
     if isinstance(column_value, list):
-        for value in column_value:
-            # Ensure the value is a string and starts with '(DHL)'
-            if isinstance(value, str) and value.startswith('(DHL)'):
-                return value.replace('(DHL)', '').strip()  # Remove prefix and strip whitespace
-        return None  # Return None if no match is found
+        # Take the first string starting with '(DHL)', remove the prefix and strip whitespace
+        # Return None if no match is found
+        return next((value[5:].strip() for value in column_value
+                     if type(value) is str and value.startswith('(DHL)')), None)
     return column_value  # Return the original value if input is not a list
 
 
@@ -465,18 +1013,23 @@ def flatten(column_value):
         list or original input: A list of concatenated strings for each dictionary in the input list, 
                                 or the original input if not a list.
     """
-    flatten_field = []
     if isinstance(column_value, list):
-        for value in column_value:
-            if isinstance(value, dict):
-                # Convert all dictionary values to strings and join them with spaces
-                value_string = ' '.join(str(value) for value in value.values())
-                flatten_field.append(value_string)
-        return flatten_field  # Return the flattened list of strings
+        # Convert all dictionary values to strings and join them with spaces
+        return [_join_values(d.values()) for d in column_value if isinstance(d, dict)]
     else:
         return column_value  # Return the original input if not a list
 
 
+def _join_values(values):
+    """
+    Joins values with spaces, converting only the values that are not already strings.
+    """
+    values = tuple(values)
+    if all(type(v) is str for v in values):
+        return ' '.join(values)
+    return ' '.join(v if type(v) is str else str(v) for v in values)
+
+
 ## REMOVE LIST FROM COLUMN RETURN ONE STRING, MULTIPLE VALUES ARE SEPARATED WITH |
 def clean(column_value):
     """
@@ -492,8 +1045,11 @@ def clean(column_value):
     """
     
     if isinstance(column_value, list):
-        # Convert each element of the list to a string and join with commas
-        return '|'.join(map(str, column_value))
+        # Join directly when all elements are already strings, the usual case for MARC values
+        if all(type(v) is str for v in column_value):
+            return '|'.join(column_value)
+        # Otherwise convert the other elements to strings and join
+        return '|'.join(v if type(v) is str else str(v) for v in column_value)
     else:
         return column_value  # Return the original input if not a list
 
@@ -531,3 +1087,90 @@ def extract(column_value, subfield):
 
     # Return None if the input is not a list
     return None
+
+
+### --- COLUMN UTILITIES - APPLY TO A WHOLE DATAFRAME COLUMN AT ONCE ---
+# Same results as the utilities above, e.g. `df[new] = clean_series(df[old])`
+# instead of `df[new] = df[old].apply(clean)`.
+
+## APPLY A UTILITY TO EVERY VALUE OF A COLUMN IN ONE PASS
+def _map_column(column, function, *args):
+    """
+    Applies `function` to every value of a column in a single list comprehension, without
+    the per-row overhead of `Series.apply`.
+
+    Args:
+        column (pd.Series): The input column.
+        function (callable): The utility to apply to each value.
+        *args: Extra arguments passed to `function` after the value.
+
+    Returns:
+        pd.Series: An object column with the results, on the index of `column`.
+    """
+    return pd.Series([function(value, *args) for value in column.tolist()],
+                     index=column.index, dtype=object)
+
+
+## EXTRACT A PARTICULAR SUBFIELD FROM A FIELD COLUMN
+def extract_series(column, subfield):
+    """
+    Column version of `extract`: extracts the values of a subfield from a column of
+    lists of dictionaries.
+
+    Args:
+        column (pd.Series): A column of lists of dictionaries.
+        subfield (str): The key to look for in each dictionary.
+
+    Returns:
+        pd.Series: A column of lists of extracted values, None where there is nothing to
+                   extract or the value is not a list.
+
+    Example:
+        df['991__d'] = extract_series(df['991'], 'd')
+    """
+    return _map_column(column, extract, subfield)
+
+
+## REMOVE SUBFIELD KEYS AND CONCATENATE VALUES IN A FIELD
+def flatten_series(column):
+    """
+    Column version of `flatten`: concatenates the dictionary values of each list item
+    into a string.
+
+    Args:
+        column (pd.Series): A column of lists of dictionaries or other types.
+
+    Returns:
+        pd.Series: A column of lists of concatenated strings, other values are left unchanged.
+    """
+    return _map_column(column, flatten)
+
+
+## REMOVE LIST FROM COLUMN RETURN ONE STRING, MULTIPLE VALUES ARE SEPARATED WITH |
+def clean_series(column):
+    """
+    Column version of `clean`: joins the elements of each list into a '|'-separated string.
+
+    Args:
+        column (pd.Series): A column of lists or other types.
+
+    Returns:
+        pd.Series: A column of '|'-separated strings, other values are left unchanged.
+    """
+    return _map_column(column, clean)
+
+
+## CONVERT MD ID - REMOVE (DHL) PREFIX FROM UNDL 035
+def convert_me_id_series(column):
+    """
+    Column version of `convert_me_id`: keeps the first list value starting with '(DHL)',
+    with the prefix removed and the result stripped of leading/trailing whitespace.
+
+    Args:
+        column (pd.Series): A column of lists or other types.
+
+    Returns:
+        pd.Series: A column of converted ids, None for lists without a match, other values
+                   are left unchanged.
+    """
+    return _map_column(column, convert_me_id)